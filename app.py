@@ -1,14 +1,27 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import boto3
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError, ClientError
-import base64
-from io import BytesIO
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerifyMismatchError
 from PIL import Image
+import diskcache
 import os
-import hashlib
-import time
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from html import escape
+from urllib.parse import quote
 from dotenv import load_dotenv
+from thumbnails import (
+    IMAGE_EXTENSIONS, MANIFEST_NAME, MAX_IMAGE_SIZE, SRCSET_WIDTHS,
+    THUMBNAIL_CACHE_CONTROL, THUMBNAIL_PREFIX, create_thumbnail,
+    create_thumbnail_from_stream, describe_image_backend, encode_jpeg,
+    flatten_to_rgb, open_thumbnail_source, prepare_for_resize, pyvips,
+    read_object_body, read_thumbnail_source, thumbnail_key, vips_source
+)
 
 # Load environment variables
 load_dotenv()
@@ -16,13 +29,25 @@ load_dotenv()
 # Configuration
 BUCKET_NAME = "sdh-saree-dhothi-ceremony"  # Replace with your bucket name
 IMAGES_PER_PAGE = 24
-MAX_IMAGE_SIZE = (250, 250)  # Thumbnail size for display
 FULLSCREEN_IMAGE_SIZE = (1440, 1440)  # Fullscreen image size
+FULLSCREEN_QUALITY = 88  # JPEG quality for fullscreen images
+THUMBNAIL_WORKERS = 16  # Concurrent thumbnail downloads per page
+THUMBNAIL_LIST_END = THUMBNAIL_PREFIX[:-1] + '0'  # Sorts right after every thumbnail key ('0' follows '/')
+PRESIGNED_URL_EXPIRY = 60*60  # Presigned URL lifetime in seconds (1 hour)
+IMAGE_CACHE_DIR = "/tmp/sdh-images"  # On-disk cache of resized images, shared across restarts and workers
+IMAGE_CACHE_SIZE = 1 << 30  # On-disk image cache limit in bytes (1 GB)
+THUMBNAIL_WRITE_BACK = False  # Upload thumbnails generated here to thumbs/; enable when thumbnail_lambda is deployed to replace them on edits
 
 # Security Configuration
 MAX_ATTEMPTS = 5  # Maximum login attempts
 LOCKOUT_DURATION = 60*60  # Lockout duration in seconds (60 minutes)
 SESSION_TIMEOUT = 60*60  # Session timeout in seconds (1 hour)
+PIN_HASH_TIME_COST = 3  # Argon2id passes; with the settings below a verify takes ~150 ms
+PIN_HASH_MEMORY_COST = 64*1024  # Argon2id memory in KiB (64 MiB)
+PIN_HASH_PARALLELISM = 1  # Argon2id lanes; one keeps concurrent logins from oversubscribing the CPU
+# Behind a reverse proxy (Streamlit Cloud, nginx) every visitor connects from the
+# proxy's IP; unless TRUSTED_PROXY names it, they all share one login lockout
+TRUSTED_PROXY = os.environ.get('TRUSTED_PROXY')  # IP of the reverse proxy whose X-Forwarded-For is trusted
 
 # Custom CSS for mobile-first responsive design
 def load_custom_css():
@@ -199,24 +224,6 @@ def load_custom_css():
         }
     }
     
-    /* Loading animation */
-    .loading-placeholder {
-        background: linear-gradient(90deg, #f0f0f0 25%, #e0e0e0 50%, #f0f0f0 75%);
-        background-size: 200% 100%;
-        animation: loading 1.5s infinite;
-        height: 200px;
-        border-radius: 4px;
-    }
-    
-    @keyframes loading {
-        0% {
-            background-position: 200% 0;
-        }
-        100% {
-            background-position: -200% 0;
-        }
-    }
-    
     /* Hide Streamlit's default sidebar toggle on mobile */
     @media (max-width: 768px) {
         .css-1d391kg {
@@ -227,17 +234,49 @@ def load_custom_css():
     """, unsafe_allow_html=True)
 
 # Security functions
-def hash_pin(pin):
-    """Hash PIN using SHA-256"""
-    return hashlib.sha256(pin.encode()).hexdigest()
+@st.cache_resource
+def get_password_hasher():
+    """Get the Argon2id hasher used for PINs"""
+    return PasswordHasher(
+        time_cost=PIN_HASH_TIME_COST,
+        memory_cost=PIN_HASH_MEMORY_COST,
+        parallelism=PIN_HASH_PARALLELISM
+    )
 
+@st.cache_resource
 def get_correct_pin_hash():
-    """Get the correct PIN hash from environment variable"""
+    """Get the Argon2 hash of the correct PIN, once per process"""
+    # Generate with: python -c "from argon2 import PasswordHasher; print(PasswordHasher(parallelism=1).hash('PIN'))"
+    pin_hash = os.environ.get('APP_PIN_HASH')
+    if pin_hash:
+        try:
+            if get_password_hasher().check_needs_rehash(pin_hash):
+                print("APP_PIN_HASH was made with other Argon2 settings than configured; consider regenerating it")  # For debugging
+        except InvalidHashError:
+            pass  # verify_pin reports it to the user
+        return pin_hash
+    
+    # Older deployments set the plain PIN; hash it once at startup
     pin = os.environ.get('APP_PIN')
-    if not pin:
-        st.error("⚠️ APP_PIN not set in environment variables!")
+    if pin:
+        print("APP_PIN holds the plain PIN; set APP_PIN_HASH instead")  # For debugging
+        return get_password_hasher().hash(pin)
+    return None
+
+def verify_pin(pin):
+    """Check an entered PIN against the stored hash"""
+    pin_hash = get_correct_pin_hash()
+    if not pin_hash:
+        st.error("⚠️ APP_PIN_HASH not set in environment variables!")
+        st.stop()
+    
+    try:
+        return get_password_hasher().verify(pin_hash, pin)
+    except VerifyMismatchError:
+        return False
+    except InvalidHashError:
+        st.error("⚠️ APP_PIN_HASH is not a valid Argon2 hash!")
         st.stop()
-    return hash_pin(pin)
 
 def initialize_security_state():
     """Initialize security-related session state"""
@@ -245,21 +284,66 @@ def initialize_security_state():
         st.session_state.authenticated = False
     if 'auth_time' not in st.session_state:
         st.session_state.auth_time = None
-    if 'failed_attempts' not in st.session_state:
-        st.session_state.failed_attempts = 0
-    if 'lockout_until' not in st.session_state:
-        st.session_state.lockout_until = None
+
+@st.cache_resource
+def get_login_attempts():
+    """Get the failed login table shared by every session in this process"""
+    # Kept server-side so opening a new browser session does not reset the count
+    return {'lock': threading.Lock(), 'clients': {}}
+
+def get_client_id():
+    """Identify the client for login throttling, by IP address where known"""
+    # With TRUSTED_PROXY unset, every client behind a proxy gets the proxy's address
+    ip_address = st.context.ip_address
+    
+    # Clients can forge X-Forwarded-For, so only read it from the trusted proxy,
+    # and only the right-most hop, which that proxy appends itself
+    if TRUSTED_PROXY and ip_address == TRUSTED_PROXY:
+        forwarded = st.context.headers.get('X-Forwarded-For')
+        if forwarded:
+            return forwarded.split(',')[-1].strip()
+    
+    # Without an address this falls back to the session, which a new session resets
+    return ip_address or get_script_run_ctx().session_id
+
+def get_failed_attempts():
+    """Get the client's recent failed logins and when they expire"""
+    login_attempts = get_login_attempts()
+    client_id = get_client_id()
+    with login_attempts['lock']:
+        entry = login_attempts['clients'].get(client_id)
+        if entry and datetime.now() >= entry['expires']:
+            # Failures age out, and any lockout with them
+            del login_attempts['clients'][client_id]
+            entry = None
+        return (entry['attempts'], entry['expires']) if entry else (0, None)
+
+def record_failed_attempt():
+    """Count a failed login for the client and return its new total"""
+    login_attempts = get_login_attempts()
+    client_id = get_client_id()
+    now = datetime.now()
+    with login_attempts['lock']:
+        clients = login_attempts['clients']
+        # Drop other clients' expired entries so the table stays small
+        for expired_id in [cid for cid, entry in clients.items() if now >= entry['expires']]:
+            del clients[expired_id]
+        
+        entry = clients.setdefault(client_id, {'attempts': 0})
+        entry['attempts'] += 1
+        entry['expires'] = now + timedelta(seconds=LOCKOUT_DURATION)
+        return entry['attempts']
+
+def clear_failed_attempts():
+    """Forget the client's failed logins"""
+    login_attempts = get_login_attempts()
+    with login_attempts['lock']:
+        login_attempts['clients'].pop(get_client_id(), None)
 
 def is_locked_out():
     """Check if user is currently locked out"""
-    if st.session_state.lockout_until:
-        if datetime.now() < st.session_state.lockout_until:
-            return True
-        else:
-            # Lockout period expired, reset
-            st.session_state.lockout_until = None
-            st.session_state.failed_attempts = 0
-    return False
+    attempts, _ = get_failed_attempts()
+    return attempts >= MAX_ATTEMPTS
 
 def is_session_expired():
     """Check if the current session has expired"""
@@ -267,6 +351,17 @@ def is_session_expired():
         return datetime.now() - st.session_state.auth_time > timedelta(seconds=SESSION_TIMEOUT)
     return True
 
+@st.fragment(run_every=1)
+def show_lockout_countdown():
+    """Show the lockout countdown, ticking every second"""
+    # Only this fragment reruns, without holding the script thread in a sleep
+    attempts, lockout_until = get_failed_attempts()
+    if attempts < MAX_ATTEMPTS:
+        st.rerun()
+    
+    remaining_time = int((lockout_until - datetime.now()).total_seconds())
+    st.error(f"🚫 Too many failed attempts. Please try again in {remaining_time} seconds.")
+
 def authenticate_user():
     """Handle user authentication"""
     initialize_security_state()
@@ -288,18 +383,15 @@ def authenticate_user():
     
     # Check if locked out
     if is_locked_out():
-        remaining_time = int((st.session_state.lockout_until - datetime.now()).total_seconds())
-        st.error(f"🚫 Too many failed attempts. Please try again in {remaining_time} seconds.")
-        
-        # Auto-refresh every 10 seconds during lockout
-        time.sleep(10)
-        st.rerun()
+        show_lockout_countdown()
         return False
     
     # Show remaining attempts
-    remaining_attempts = MAX_ATTEMPTS - st.session_state.failed_attempts
-    if st.session_state.failed_attempts > 0:
-        st.warning(f"⚠️ {remaining_attempts} attempts remaining before lockout.")
+    failed_attempts, _ = get_failed_attempts()
+    remaining_attempts = MAX_ATTEMPTS - failed_attempts
+    attempts_notice = st.empty()
+    if failed_attempts > 0:
+        attempts_notice.warning(f"⚠️ {remaining_attempts} attempts remaining before lockout.")
     
     # PIN input form
     with st.form("login_form"):
@@ -319,32 +411,24 @@ def authenticate_user():
                 return False
             
             # Verify PIN
-            correct_pin_hash = get_correct_pin_hash()
-            entered_pin_hash = hash_pin(pin_input)
-            
-            if entered_pin_hash == correct_pin_hash:
+            if verify_pin(pin_input):
                 # Successful login
                 st.session_state.authenticated = True
                 st.session_state.auth_time = datetime.now()
-                st.session_state.failed_attempts = 0
-                st.session_state.lockout_until = None
-                st.success("✅ Authentication successful!")
-                time.sleep(1)
+                clear_failed_attempts()
                 st.rerun()
             else:
                 # Failed login
-                st.session_state.failed_attempts += 1
+                failed_attempts = record_failed_attempt()
                 
-                if st.session_state.failed_attempts >= MAX_ATTEMPTS:
-                    # Lockout user
-                    st.session_state.lockout_until = datetime.now() + timedelta(seconds=LOCKOUT_DURATION)
-                    st.error(f"🚫 Too many failed attempts! Locked out for {LOCKOUT_DURATION // 60} minutes.")
+                if failed_attempts >= MAX_ATTEMPTS:
+                    # Lockout user and swap the form for the countdown
+                    st.rerun()
                 else:
-                    remaining = MAX_ATTEMPTS - st.session_state.failed_attempts
+                    # The error carries the updated count, replacing the stale notice
+                    attempts_notice.empty()
+                    remaining = MAX_ATTEMPTS - failed_attempts
                     st.error(f"❌ Incorrect PIN. {remaining} attempts remaining.")
-                
-                time.sleep(2)
-                st.rerun()
     
     return False
 
@@ -352,8 +436,6 @@ def logout_user():
     """Handle user logout"""
     st.session_state.authenticated = False
     st.session_state.auth_time = None
-    st.session_state.failed_attempts = 0
-    st.session_state.lockout_until = None
     st.rerun()
 
 # Initialize S3 client
@@ -361,28 +443,77 @@ def logout_user():
 def get_s3_client():
     """Initialize S3 client with credentials"""
     try:
-        return boto3.client(
-            's3',
+        # A dedicated session rather than boto3's module-level default one,
+        # which is not safe to share with the thumbnail worker threads
+        session = boto3.session.Session(
             aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
             aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
             region_name='ap-south-1'
         )
+        return session.client(
+            's3',
+            config=Config(
+                # The client is shared by every session, so leave room for
+                # several pages' concurrent thumbnail downloads at once
+                max_pool_connections=64,
+                tcp_keepalive=True,
+                retries={'mode': 'adaptive', 'max_attempts': 3},
+                connect_timeout=3,
+                read_timeout=10
+            )
+        )
     except NoCredentialsError:
         st.error("AWS credentials not found. Please configure your credentials.")
         return None
 
-def list_folders(s3_client, bucket, prefix=""):
-    """List folders in S3 bucket"""
+@st.cache_resource
+def prewarm_s3_connection():
+    """Open a pooled S3 connection in the background, once per process"""
+    s3_client = get_s3_client()
+    if not s3_client:
+        return
+    
+    def head_bucket():
+        try:
+            # Doubles as the bucket check, so the first logged-in run
+            # finds it cached instead of making a second round trip
+            verify_bucket(BUCKET_NAME)
+        except Exception as e:
+            # Failures are not cached; main reports them once the user is logged in
+            print(f"S3 pre-warm failed: {e}")  # For debugging
+    
+    threading.Thread(target=head_bucket, daemon=True).start()
+
+@st.cache_resource(show_spinner=False)
+def verify_bucket(bucket):
+    """Check the bucket is reachable, once per server process"""
+    # Failures raise and are not cached, so the check retries on the next run
+    get_s3_client().head_bucket(Bucket=bucket)
+    return True
+
+@st.cache_data(ttl=300, show_spinner=False)  # Cache for 5 minutes
+def list_folders(bucket, prefix=""):
+    """List folders in S3 bucket with caching"""
+    s3_client = get_s3_client()
+    if not s3_client:
+        return []
+    
     try:
-        response = s3_client.list_objects_v2(
+        # Page through the listing; a single call stops at 1000 entries
+        paginator = s3_client.get_paginator('list_objects_v2')
+        page_iterator = paginator.paginate(
             Bucket=bucket,
             Prefix=prefix,
-            Delimiter='/'
+            Delimiter='/',
+            PaginationConfig={'PageSize': 1000}
         )
         
         folders = []
-        if 'CommonPrefixes' in response:
-            for obj in response['CommonPrefixes']:
+        for page in page_iterator:
+            for obj in page.get('CommonPrefixes', []):
+                # Pre-generated thumbnails are not a gallery folder
+                if obj['Prefix'] == THUMBNAIL_PREFIX:
+                    continue
                 folder_name = obj['Prefix'].rstrip('/').split('/')[-1]
                 folders.append((folder_name, obj['Prefix']))
         
@@ -391,80 +522,223 @@ def list_folders(s3_client, bucket, prefix=""):
         st.error(f"Error listing folders: {e}")
         return []
 
-@st.cache_data(ttl=300)  # Cache for 5 minutes
-def list_images(bucket, prefix, max_keys=1000):
+def make_image_record(key, size, last_modified, etag):
+    """Build the listing entry for one image"""
+    return {
+        'key': key,
+        'size': size,
+        'last_modified': last_modified,
+        'etag': etag,
+        'filename': key.split('/')[-1],
+        # Display strings, formatted once per listing instead of per render
+        'size_kb': f"{size / 1024:.1f}",
+        'modified_str': last_modified.strftime('%m/%d/%Y')
+    }
+
+def read_image_manifest(s3_client, bucket, prefix):
+    """Read a folder's image manifest, or None if it has none"""
+    # Format: JSON list of {"key", "size", "last_modified" (ISO 8601), "etag"}
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=prefix + MANIFEST_NAME)
+        entries = json.loads(response['Body'].read())
+        return [
+            make_image_record(
+                entry['key'],
+                entry['size'],
+                datetime.fromisoformat(entry['last_modified']),
+                entry['etag']
+            )
+            for entry in entries
+        ]
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            print(f"Error reading manifest for '{prefix}': {e}")  # For debugging
+        return None
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Invalid manifest for '{prefix}': {e}")  # For debugging
+        return None
+
+def list_gallery_objects(s3_client, bucket, prefix, start_after=None):
+    """Yield every object under a prefix, except pre-generated thumbnails"""
+    # Page through every key under the prefix; a single call stops at 1000
+    paginator = s3_client.get_paginator('list_objects_v2')
+    params = {'Bucket': bucket, 'Prefix': prefix, 'PaginationConfig': {'PageSize': 1000}}
+    if start_after:
+        params['StartAfter'] = start_after
+    
+    for page in paginator.paginate(**params):
+        for obj in page.get('Contents', []):
+            if obj['Key'].startswith(THUMBNAIL_PREFIX):
+                # Keys arrive in order and the thumbnails are contiguous, so have
+                # S3 resume after the last one rather than paging through them
+                yield from list_gallery_objects(s3_client, bucket, prefix, THUMBNAIL_LIST_END)
+                return
+            yield obj
+
+# Listings are cached as shared, read-only objects, so a rerun slices out its
+# page without unpickling a copy of the whole folder
+@st.cache_resource(ttl=300, show_spinner=False)  # Cache for 5 minutes
+def list_images(bucket, prefix):
     """List image files in S3 with caching"""
     s3_client = get_s3_client()
     if not s3_client:
         return []
     
     try:
-        response = s3_client.list_objects_v2(
-            Bucket=bucket,
-            Prefix=prefix,
-            MaxKeys=max_keys
-        )
+        # One small GET replaces paging through a large folder
+        images = read_image_manifest(s3_client, bucket, prefix)
+        if images is not None:
+            return sorted(images, key=lambda x: x['last_modified'], reverse=True)
         
-        images = []
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                key = obj['Key']
-                # Filter for common image extensions and exclude zero-byte files
-                if (key.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')) 
-                    and obj['Size'] > 0):
-                    images.append({
-                        'key': key,
-                        'size': obj['Size'],
-                        'last_modified': obj['LastModified'],
-                        'filename': key.split('/')[-1]
-                    })
+        # Filter for common image extensions and exclude zero-byte files
+        images = [
+            make_image_record(obj['Key'], obj['Size'], obj['LastModified'], obj['ETag'])
+            for obj in list_gallery_objects(s3_client, bucket, prefix)
+            if obj['Key'].rpartition('.')[2].lower() in IMAGE_EXTENSIONS
+            and obj['Size'] > 0
+        ]
         
         return sorted(images, key=lambda x: x['last_modified'], reverse=True)
     except ClientError as e:
         st.error(f"Error listing images: {e}")
         return []
 
-@st.cache_data(ttl=3600)  # Cache images for 1 hour
-def get_image_thumbnail(bucket, key):
+@st.cache_resource(ttl=300, show_spinner=False)  # Cache for 5 minutes
+def list_images_by_name(bucket, prefix):
+    """List image files sorted by filename, reusing the cached listing"""
+    return sorted(list_images(bucket, prefix), key=lambda x: x['filename'].lower())
+
+@st.cache_data(ttl=300, show_spinner=False)  # Cache for 5 minutes
+def list_thumbnail_keys(bucket, prefix):
+    """List the pre-generated thumbnails available under a prefix"""
+    s3_client = get_s3_client()
+    if not s3_client:
+        return set()
+    
+    try:
+        paginator = s3_client.get_paginator('list_objects_v2')
+        page_iterator = paginator.paginate(
+            Bucket=bucket,
+            Prefix=THUMBNAIL_PREFIX + prefix,
+            PaginationConfig={'PageSize': 1000}
+        )
+        return {obj['Key'] for page in page_iterator for obj in page.get('Contents', [])}
+    except ClientError as e:
+        print(f"Error listing thumbnails: {e}")  # For debugging
+        return set()
+
+@st.cache_data(ttl=PRESIGNED_URL_EXPIRY - 600, show_spinner=False)  # Refresh URLs before they expire
+def get_presigned_url(bucket, key, download_name=None):
+    """Get a presigned URL the browser can load directly from S3"""
+    s3_client = get_s3_client()
+    if not s3_client:
+        return None
+    
+    params = {'Bucket': bucket, 'Key': key}
+    if download_name:
+        # Have S3 serve the object as a file download
+        params['ResponseContentDisposition'] = f"attachment; filename*=UTF-8''{quote(download_name)}"
+    
+    return s3_client.generate_presigned_url(
+        'get_object',
+        Params=params,
+        ExpiresIn=PRESIGNED_URL_EXPIRY
+    )
+
+@st.cache_resource
+def report_image_backend():
+    """Log the imaging libraries this process uses, once per process"""
+    print(f"Image backend: {describe_image_backend()}")
+
+@st.cache_resource
+def get_image_cache():
+    """Open the on-disk image cache shared by all sessions"""
+    return diskcache.Cache(
+        IMAGE_CACHE_DIR,
+        size_limit=IMAGE_CACHE_SIZE,
+        eviction_policy='least-recently-used'
+    )
+
+@st.cache_resource
+def get_thumbnail_write_back():
+    """Get the process-wide switch for uploading generated thumbnails"""
+    return {'enabled': THUMBNAIL_WRITE_BACK}
+
+def save_thumbnail_to_s3(s3_client, bucket, key, thumbnail):
+    """Upload a generated thumbnail where pre-generated ones live"""
+    write_back = get_thumbnail_write_back()
+    if not write_back['enabled']:
+        return False
+    
+    try:
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=thumbnail_key(key),
+            Body=thumbnail,
+            ContentType='image/jpeg',
+            CacheControl=THUMBNAIL_CACHE_CONTROL
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'AccessDenied':
+            # Read-only credentials; stop trying for the rest of this process
+            write_back['enabled'] = False
+        print(f"Could not save thumbnail for {key}: {e}")  # For debugging
+        return False
+
+def thumbnail_cache_key(etag):
+    """Get the disk cache key of a thumbnail from its image's ETag"""
+    # The ETag comes with the listing and changes whenever the image is edited
+    return f"thumbnail:{etag}:{MAX_IMAGE_SIZE[0]}x{MAX_IMAGE_SIZE[1]}"
+
+def get_image_thumbnail(bucket, key, etag):
     """Get image thumbnail with caching"""
+    # The disk cache survives restarts; an edited image gets a new ETag
+    image_cache = get_image_cache()
+    cache_key = thumbnail_cache_key(etag)
+    thumbnail = image_cache.get(cache_key)
+    if thumbnail is not None:
+        return thumbnail
+    
     s3_client = get_s3_client()
     if not s3_client:
         return None
     
+    # Made while the page waits, so use the quick baseline encode;
+    # sync_thumbs.py writes progressive, optimized ones ahead of time
     try:
-        # Get object from S3
-        response = s3_client.get_object(Bucket=bucket, Key=key)
-        image_data = response['Body'].read()
+        response = open_thumbnail_source(s3_client, bucket, key)
         
-        # Validate that we have data
-        if not image_data or len(image_data) == 0:
-            st.error(f"Empty image file: {key}")
-            return None
+        # libvips decodes the download while it streams in; a failed read raises
+        # rather than leaving a half-decoded thumbnail in the cache
+        if pyvips is not None:
+            try:
+                thumbnail = create_thumbnail_from_stream(
+                    response['Body'], optimize=False, partial=response.get('Partial', False)
+                )
+            except pyvips.Error as vips_error:
+                print(f"libvips cannot stream {key.split('/')[-1]}, buffering it: {vips_error}")  # For debugging
+                # Release the partly read download's connection before fetching again
+                response['Body'].close()
+                response = open_thumbnail_source(s3_client, bucket, key)
         
-        # Try to open and process the image
-        try:
-            image_buffer = BytesIO(image_data)
-            image = Image.open(image_buffer)
-            
-            # Convert to RGB if necessary (handles RGBA, P mode, etc.)
-            if image.mode not in ('RGB', 'L'):
-                image = image.convert('RGB')
-            
-            # Create thumbnail
-            image.thumbnail(MAX_IMAGE_SIZE, Image.Resampling.LANCZOS)
+        if thumbnail is None:
+            # Get object from S3
+            image_buffer = read_thumbnail_source(response)
             
-            # Convert to base64 for display
-            output_buffer = BytesIO()
-            image.save(output_buffer, format='JPEG', quality=85, optimize=True)
-            img_base64 = base64.b64encode(output_buffer.getvalue()).decode()
+            # Validate that we have data
+            if image_buffer is None:
+                st.error(f"Empty image file: {key}")
+                return None
             
-            return img_base64
-            
-        except Exception as img_error:
-            # Log the specific image processing error
-            error_msg = f"Cannot process image {key.split('/')[-1]}: {str(img_error)}"
-            print(error_msg)  # For debugging
-            return None
+            # Try to open and process the image
+            try:
+                thumbnail = create_thumbnail(image_buffer, key, optimize=False)
+            except Exception as img_error:
+                # Log the specific image processing error
+                error_msg = f"Cannot process image {key.split('/')[-1]}: {str(img_error)}"
+                print(error_msg)  # For debugging
+                return None
             
     except ClientError as e:
         error_msg = f"S3 error loading {key}: {e}"
@@ -474,10 +748,80 @@ def get_image_thumbnail(bucket, key):
         error_msg = f"Unexpected error loading {key}: {e}"
         print(error_msg)  # For debugging
         return None
+    
+    # Key it by what was downloaded; the listing's ETag may predate an edit
+    image_cache.set(thumbnail_cache_key(response.get('ETag', etag)), thumbnail)
+    return thumbnail
+
+def generate_thumbnail(bucket, img):
+    """Generate a missing thumbnail, as a presigned URL once it is saved to S3"""
+    thumbnail = get_image_thumbnail(bucket, img['key'], img['etag'])
+    if thumbnail is not None and save_thumbnail_to_s3(get_s3_client(), bucket, img['key'], thumbnail):
+        # The browser loads it lazily from S3 rather than over the websocket
+        return {'src': get_presigned_url(bucket, thumbnail_key(img['key'])), 'srcset': ""}
+    return thumbnail
 
-@st.cache_data(ttl=3600)  # Cache fullscreen images for 1 hour
-def get_fullscreen_image(bucket, key):
+def create_fullscreen_with_vips(body):
+    """Create fullscreen JPEG bytes with libvips, decoding while the S3 body streams in"""
+    # libvips reads the source lazily, so it stays referenced here until the save
+    read_errors = []
+    source = vips_source(body, read_errors)
+    
+    # A download cut short must fail rather than come out half grey
+    image = pyvips.Image.thumbnail_source(
+        source, FULLSCREEN_IMAGE_SIZE[0], height=FULLSCREEN_IMAGE_SIZE[1], size='down',
+        option_string='fail_on=truncated'
+    )
+    
+    # JPEG has no alpha channel; flatten transparent images onto white
+    if image.hasalpha():
+        image = image.flatten(background=[255, 255, 255])
+    
+    try:
+        fullscreen_image = image.jpegsave_buffer(Q=FULLSCREEN_QUALITY, interlace=True, strip=True)
+    except pyvips.Error:
+        # The truncation libvips reports was caused by the failed read
+        if read_errors:
+            raise read_errors[0]
+        raise
+    
+    # cffi only logs errors raised in the read callback, so raise them here
+    if read_errors:
+        raise read_errors[0]
+    return fullscreen_image
+
+def create_fullscreen_with_pillow(image_buffer):
+    """Create fullscreen JPEG bytes with Pillow"""
+    image = Image.open(image_buffer)
+    
+    # Decode large JPEGs at reduced scale, still at least the fullscreen size
+    if image.format == 'JPEG':
+        image.draft('RGB', FULLSCREEN_IMAGE_SIZE)
+    
+    image = prepare_for_resize(image)
+    
+    # Box-filter by the whole factor that still covers the fullscreen size
+    factor = min(image.width // FULLSCREEN_IMAGE_SIZE[0], image.height // FULLSCREEN_IMAGE_SIZE[1])
+    if factor > 1:
+        image = image.reduce(factor)
+    
+    # Resize the remainder if still too large; the browser rescales it anyway
+    if image.size[0] > FULLSCREEN_IMAGE_SIZE[0] or image.size[1] > FULLSCREEN_IMAGE_SIZE[1]:
+        image.thumbnail(FULLSCREEN_IMAGE_SIZE, Image.Resampling.BILINEAR, reducing_gap=None)
+    
+    # Composite any transparency onto white after the resize
+    image = flatten_to_rgb(image)
+    
+    return encode_jpeg(image, FULLSCREEN_QUALITY)
+
+def get_fullscreen_image(bucket, key, etag):
     """Get full-resolution image for fullscreen display"""
+    image_cache = get_image_cache()
+    cache_key = f"fullscreen:{etag}:{FULLSCREEN_IMAGE_SIZE[0]}x{FULLSCREEN_IMAGE_SIZE[1]}"
+    fullscreen_image = image_cache.get(cache_key)
+    if fullscreen_image is not None:
+        return fullscreen_image
+    
     s3_client = get_s3_client()
     if not s3_client:
         return None
@@ -485,64 +829,153 @@ def get_fullscreen_image(bucket, key):
     try:
         # Get object from S3
         response = s3_client.get_object(Bucket=bucket, Key=key)
-        image_data = response['Body'].read()
         
-        # Validate that we have data
-        if not image_data or len(image_data) == 0:
-            return None
+        if pyvips is not None:
+            try:
+                fullscreen_image = create_fullscreen_with_vips(response['Body'])
+            except pyvips.Error as vips_error:
+                print(f"libvips cannot process {key.split('/')[-1]}, using Pillow: {vips_error}")  # For debugging
+                # The stream is partly consumed, so release it and download the image again
+                response['Body'].close()
+                response = s3_client.get_object(Bucket=bucket, Key=key)
         
-        # Try to open and process the image
-        try:
-            image_buffer = BytesIO(image_data)
-            image = Image.open(image_buffer)
-            
-            # Convert to RGB if necessary
-            if image.mode not in ('RGB', 'L'):
-                image = image.convert('RGB')
-            
-            # Resize for fullscreen if too large
-            if image.size[0] > FULLSCREEN_IMAGE_SIZE[0] or image.size[1] > FULLSCREEN_IMAGE_SIZE[1]:
-                image.thumbnail(FULLSCREEN_IMAGE_SIZE, Image.Resampling.LANCZOS)
+        if fullscreen_image is None:
+            image_buffer = read_object_body(response)
             
-            # Convert to base64 for display
-            output_buffer = BytesIO()
-            image.save(output_buffer, format='JPEG', quality=95, optimize=True)
-            img_base64 = base64.b64encode(output_buffer.getvalue()).decode()
+            # Validate that we have data
+            if image_buffer is None:
+                return None
             
-            return img_base64
-            
-        except Exception as img_error:
-            return None
+            fullscreen_image = create_fullscreen_with_pillow(image_buffer)
             
     except Exception as e:
+        print(f"Error loading fullscreen image {key}: {e}")  # For debugging
         return None
+    
+    image_cache.set(cache_key, fullscreen_image)
+    return fullscreen_image
 
-def show_fullscreen_image(image_base64, filename):
+def get_page_thumbnails(bucket, prefix, images):
+    """Get thumbnails for a page of images as presigned URLs or JPEG bytes"""
+    # Pre-generated thumbnails are fetched by the browser straight from S3,
+    # with any responsive widths offered as a srcset
+    available = list_thumbnail_keys(bucket, prefix)
+    thumbnails = {
+        img['key']: {
+            'src': get_presigned_url(bucket, thumbnail_key(img['key'])),
+            'srcset': ", ".join(
+                f"{get_presigned_url(bucket, thumbnail_key(img['key'], width))} {width}w"
+                for width in SRCSET_WIDTHS
+                if thumbnail_key(img['key'], width) in available
+            )
+        }
+        for img in images
+        if thumbnail_key(img['key']) in available
+    }
+    
+    # Serve thumbnails already in the disk cache without starting any threads
+    image_cache = get_image_cache()
+    for img in images:
+        if img['key'] not in thumbnails:
+            thumbnail = image_cache.get(thumbnail_cache_key(img['etag']))
+            if thumbnail is not None:
+                thumbnails[img['key']] = thumbnail
+    
+    # Generate the rest here, concurrently so S3 round-trips overlap
+    missing = [img for img in images if img['key'] not in thumbnails]
+    if missing:
+        # Worker threads need the script context to use Streamlit's caches
+        ctx = get_script_run_ctx()
+        with ThreadPoolExecutor(
+            max_workers=min(THUMBNAIL_WORKERS, len(missing)),
+            initializer=add_script_run_ctx,
+            initargs=(None, ctx)
+        ) as executor:
+            generated = list(executor.map(lambda img: generate_thumbnail(bucket, img), missing))
+        thumbnails.update(zip([img['key'] for img in missing], generated))
+        
+        # Pick up the uploaded thumbnails on the next run instead of after the TTL
+        if any(isinstance(thumbnail, dict) for thumbnail in generated):
+            list_thumbnail_keys.clear(bucket, prefix)
+    
+    return [thumbnails[img['key']] for img in images]
+
+def show_fullscreen_image(image_info):
     """Display fullscreen image view"""
     st.markdown(f"""
     <div class="fullscreen-header">
-        <h3>🔍 {filename}</h3>
+        <h3>🔍 {image_info['filename']}</h3>
     </div>
     """, unsafe_allow_html=True)
     
     # Close button at the top
-    if st.button("✕ Close", key="close_fullscreen", use_container_width=True, type="primary"):
-        st.session_state.fullscreen_image = None
-        st.rerun()
+    st.button(
+        "✕ Close",
+        key="close_fullscreen",
+        use_container_width=True,
+        type="primary",
+        on_click=close_fullscreen
+    )
     
     # Display the image
-    st.image(f"data:image/jpeg;base64,{image_base64}", use_container_width=True)
+    with st.spinner("Loading fullscreen image..."):
+        image_data = get_fullscreen_image(BUCKET_NAME, image_info['key'], image_info['etag'])
+    if image_data:
+        st.image(image_data, output_format='JPEG', use_container_width=True)
+    else:
+        st.error("Could not load fullscreen image")
     
     # Close button at the bottom
-    if st.button("← Back to Gallery", key="back_to_gallery", use_container_width=True):
-        st.session_state.fullscreen_image = None
-        st.rerun()
+    st.button(
+        "← Back to Gallery",
+        key="back_to_gallery",
+        use_container_width=True,
+        on_click=close_fullscreen
+    )
 
-def paginate_images(images, page, per_page):
-    """Paginate image list"""
+def page_bounds(total, page, per_page):
+    """Get the start and end indices of a page of images"""
     start = page * per_page
-    end = start + per_page
-    return images[start:end], len(images)
+    return start, min(total, start + per_page)
+
+# Navigation callbacks; they update state before the rerun, so no extra st.rerun() is needed
+def open_folder(folder_path):
+    """Navigate into a folder, remembering the current one"""
+    st.session_state.update(
+        path_history=st.session_state.path_history + [st.session_state.current_path],
+        current_path=folder_path,
+        page=0
+    )
+
+def go_back():
+    """Navigate to the previous folder"""
+    history = st.session_state.path_history
+    st.session_state.update(
+        path_history=history[:-1],
+        current_path=history[-1] if history else "",
+        page=0
+    )
+
+def go_to_page(page):
+    """Navigate to a page of the current folder"""
+    st.session_state.page = page
+
+def go_to_entered_page():
+    """Navigate to the page number typed into the page input"""
+    st.session_state.page = st.session_state.page_input - 1
+
+def open_fullscreen(img_info):
+    """Open an image in the fullscreen view"""
+    # Keep only what identifies the image; its bytes live in the disk cache
+    st.session_state.fullscreen_image = {
+        'key': img_info['key'],
+        'etag': img_info['etag'],
+        'filename': img_info['filename']
+    }
+
+def close_fullscreen():
+    """Return from the fullscreen view to the gallery"""
+    st.session_state.fullscreen_image = None
 
 def main():
     st.set_page_config(
@@ -554,6 +987,10 @@ def main():
     
     # Load custom CSS
     load_custom_css()
+    report_image_backend()
+    
+    # Handshake with S3 while the first visitor types their PIN
+    prewarm_s3_connection()
     
     # Authentication check - this runs first
     if not authenticate_user():
@@ -565,10 +1002,7 @@ def main():
     
     # Show fullscreen image if requested
     if st.session_state.fullscreen_image:
-        show_fullscreen_image(
-            st.session_state.fullscreen_image['data'],
-            st.session_state.fullscreen_image['filename']
-        )
+        show_fullscreen_image(st.session_state.fullscreen_image)
         return
     
     # Main app content (only shown if authenticated and not in fullscreen mode)
@@ -600,6 +1034,12 @@ def main():
     with st.sidebar:
         st.header("⚙️ Settings")
         images_per_page = st.slider("Images per page", 8, 60, 20, help="Adjust for better performance")
+        sort_order = st.selectbox(
+            "Sort images by",
+            ["Newest first", "Name"],
+            on_change=go_to_page,
+            args=(0,)
+        )
         st.header("📱 Mobile Optimized")
         st.info("This app is designed for mobile-first experience")
     
@@ -617,7 +1057,7 @@ def main():
     
     # Test S3 connection
     try:
-        s3_client.head_bucket(Bucket=BUCKET_NAME)
+        verify_bucket(BUCKET_NAME)
     except ClientError as e:
         if e.response['Error']['Code'] == '404':
             st.error(f"Bucket '{BUCKET_NAME}' not found.")
@@ -639,48 +1079,54 @@ def main():
                 breadcrumb += f" › {part}"
         st.markdown(f"### {breadcrumb}")
         
-        if st.button("⬅️ Back", use_container_width=True):
-            if st.session_state.path_history:
-                st.session_state.current_path = st.session_state.path_history.pop()
-            else:
-                st.session_state.current_path = ""
-            st.session_state.page = 0
-            st.rerun()
+        st.button("⬅️ Back", on_click=go_back, use_container_width=True)
     else:
         st.markdown("### 🏠 Home")
     
     # List folders at current level
-    folders = list_folders(s3_client, BUCKET_NAME, st.session_state.current_path)
+    folders = list_folders(BUCKET_NAME, st.session_state.current_path)
     
     if folders:
         st.markdown("#### 📂 Folders")
         for folder_name, folder_path in folders:
-            if st.button(f"📁 {folder_name}", key=f"folder_{folder_name}", use_container_width=True):
-                st.session_state.path_history.append(st.session_state.current_path)
-                st.session_state.current_path = folder_path
-                st.session_state.page = 0
-                st.rerun()
+            st.button(
+                f"📁 {folder_name}",
+                key=f"folder_{folder_name}",
+                on_click=open_folder,
+                args=(folder_path,),
+                use_container_width=True
+            )
     
     # List and display images
-    images = list_images(BUCKET_NAME, st.session_state.current_path)
+    if sort_order == "Name":
+        images = list_images_by_name(BUCKET_NAME, st.session_state.current_path)
+    else:
+        images = list_images(BUCKET_NAME, st.session_state.current_path)
     
     if not images:
         st.info("📷 No images found in this folder.")
         return
     
     # Pagination
-    current_images, total_images = paginate_images(
-        images, st.session_state.page, images_per_page
-    )
+    total_images = len(images)
+    total_pages = (total_images - 1) // images_per_page + 1
+    
+    # The listing or page size may have changed since the page was picked
+    st.session_state.page = min(st.session_state.page, total_pages - 1)
+    start, end = page_bounds(total_images, st.session_state.page, images_per_page)
+    current_images = images[start:end]
     
     # Pagination controls
-    total_pages = (total_images - 1) // images_per_page + 1
     
     col1, col2, col3 = st.columns([1, 2, 1])
     with col1:
-        if st.button("⬅️ Previous", disabled=st.session_state.page == 0, use_container_width=True):
-            st.session_state.page = max(0, st.session_state.page - 1)
-            st.rerun()
+        st.button(
+            "⬅️ Previous",
+            disabled=st.session_state.page == 0,
+            on_click=go_to_page,
+            args=(max(0, st.session_state.page - 1),),
+            use_container_width=True
+        )
     
     with col2:
         st.markdown(f"""
@@ -691,14 +1137,18 @@ def main():
         """, unsafe_allow_html=True)
     
     with col3:
-        if st.button("Next ➡️", disabled=st.session_state.page >= total_pages - 1, use_container_width=True):
-            st.session_state.page = min(total_pages - 1, st.session_state.page + 1)
-            st.rerun()
+        st.button(
+            "Next ➡️",
+            disabled=st.session_state.page >= total_pages - 1,
+            on_click=go_to_page,
+            args=(min(total_pages - 1, st.session_state.page + 1),),
+            use_container_width=True
+        )
     
     # Direct page navigation
     if total_pages > 1:
         st.markdown("**Go to page:**")
-        page_input = st.number_input(
+        st.number_input(
             "Enter page number:",
             min_value=1,
             max_value=total_pages,
@@ -707,9 +1157,7 @@ def main():
             key="page_input"
         )
         
-        if st.button("Go to Page", use_container_width=True):
-            st.session_state.page = page_input - 1
-            st.rerun()
+        st.button("Go to Page", on_click=go_to_entered_page, use_container_width=True)
     
     # Display images in responsive grid
     if current_images:
@@ -722,36 +1170,45 @@ def main():
         if st.session_state.get('screen_width', 768) > 1024:
             cols = st.columns(4)  # 4 columns for desktop
         
-        for i, img_info in enumerate(current_images):
+        # Rendered tile width for srcset; Streamlit stacks columns on narrow screens
+        tile_sizes = f"(max-width: 640px) 100vw, {100 // len(cols)}vw"
+        
+        # Resolve the whole page at once so S3 round-trips overlap; one spinner
+        # covers the batch, and only appears if it is slow
+        with st.spinner(f"Loading {len(current_images)} thumbnails..."):
+            thumbnails = get_page_thumbnails(
+                BUCKET_NAME, st.session_state.current_path, current_images
+            )
+        
+        for i, (img_info, thumbnail) in enumerate(zip(current_images, thumbnails)):
             with cols[i % len(cols)]:
                 with st.container():
-                    # Create a card-like container
-                    card_html = f"""
-                    <div class="image-container">
-                        <div class="loading-placeholder" id="loading-{i}"></div>
-                    </div>
-                    """
-                    placeholder = st.empty()
-                    placeholder.markdown(card_html, unsafe_allow_html=True)
-                    
-                    # Load thumbnail
-                    thumbnail = get_image_thumbnail(BUCKET_NAME, img_info['key'])
-                    
                     if thumbnail:
-                        placeholder.empty()
-                        
                         # Display image
-                        st.image(
-                            f"data:image/jpeg;base64,{thumbnail}",
-                            use_container_width=True
-                        )
+                        if isinstance(thumbnail, dict):
+                            # The browser picks the smallest srcset width for the tile,
+                            # and defers fetching and decoding off-screen tiles
+                            srcset = ""
+                            if thumbnail['srcset']:
+                                srcset = f' srcset="{escape(thumbnail["srcset"])}" sizes="{tile_sizes}"'
+                            st.markdown(f"""
+                            <div class="image-container">
+                                <img src="{escape(thumbnail['src'])}" alt="{escape(img_info['filename'])}"{srcset} loading="lazy" decoding="async">
+                            </div>
+                            """, unsafe_allow_html=True)
+                        else:
+                            st.image(
+                                thumbnail,
+                                output_format='JPEG',
+                                use_container_width=True
+                            )
                         
                         # Image info
                         st.markdown(f"""
                         <div class="image-info">
                             <div class="image-filename">{img_info['filename']}</div>
                             <div class="image-details">
-                                {img_info['size'] / 1024:.1f} KB • {img_info['last_modified'].strftime('%m/%d/%Y')}
+                                {img_info['size_kb']} KB • {img_info['modified_str']}
                             </div>
                         </div>
                         """, unsafe_allow_html=True)
@@ -760,37 +1217,24 @@ def main():
                         col_view, col_download = st.columns(2)
                         
                         with col_view:
-                            if st.button("👁️ View", key=f"view_{img_info['key']}", use_container_width=True):
-                                # Load fullscreen image
-                                with st.spinner("Loading fullscreen image..."):
-                                    fullscreen_img = get_fullscreen_image(BUCKET_NAME, img_info['key'])
-                                    if fullscreen_img:
-                                        st.session_state.fullscreen_image = {
-                                            'data': fullscreen_img,
-                                            'filename': img_info['filename']
-                                        }
-                                        st.rerun()
-                                    else:
-                                        st.error("Could not load fullscreen image")
+                            st.button(
+                                "👁️ View",
+                                key=f"view_{img_info['key']}",
+                                use_container_width=True,
+                                on_click=open_fullscreen,
+                                args=(img_info,)
+                            )
                         
                         with col_download:
-                            if st.button("⬇️ Save", key=f"download_{img_info['key']}", use_container_width=True):
-                                try:
-                                    response = s3_client.get_object(Bucket=BUCKET_NAME, Key=img_info['key'])
-                                    st.download_button(
-                                        label="💾 Download",
-                                        data=response['Body'].read(),
-                                        file_name=img_info['filename'],
-                                        mime='image/jpeg',
-                                        use_container_width=True,
-                                        key=f"dl_btn_{img_info['key']}"
-                                    )
-                                except ClientError as e:
-                                    st.error(f"Download failed: {e}")
+                            # The browser downloads the original straight from S3
+                            st.link_button(
+                                "⬇️ Save",
+                                get_presigned_url(BUCKET_NAME, img_info['key'], img_info['filename']),
+                                use_container_width=True
+                            )
                     else:
-                        placeholder.empty()
                         st.error(f"❌ Failed to load: {img_info['filename'][:20]}...")
-                        st.caption(f"Size: {img_info['size'] / 1024:.1f} KB")
+                        st.caption(f"Size: {img_info['size_kb']} KB")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
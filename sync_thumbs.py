@@ -0,0 +1,96 @@
+"""Pre-generate gallery thumbnails into the bucket's thumbs/ prefix
+
+Usage: python sync_thumbs.py [--prefix FOLDER/] [--force] [BUCKET]
+
+The app serves these as presigned URLs, so the browser loads them straight
+from S3 instead of the server decoding every original.
+"""
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import boto3
+from botocore.config import Config
+from dotenv import load_dotenv
+from thumbnails import (
+    IMAGE_EXTENSIONS, SRCSET_WIDTHS, THUMBNAIL_PREFIX, describe_image_backend,
+    thumbnail_key, write_thumbnails
+)
+
+# Load environment variables
+load_dotenv()
+
+# Configuration
+BUCKET_NAME = "sdh-saree-dhothi-ceremony"  # Replace with your bucket name
+SYNC_WORKERS = 16  # Concurrent thumbnail jobs
+
+def get_s3_client():
+    """Initialize S3 client with credentials"""
+    return boto3.client(
+        's3',
+        aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
+        region_name='ap-south-1',
+        config=Config(
+            max_pool_connections=SYNC_WORKERS * 2,
+            retries={'mode': 'adaptive', 'max_attempts': 5}
+        )
+    )
+
+def list_keys(s3_client, bucket, prefix):
+    """Yield every object under a prefix as (key, size)"""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            yield obj['Key'], obj['Size']
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate gallery thumbnails in S3")
+    parser.add_argument('bucket', nargs='?', default=BUCKET_NAME)
+    parser.add_argument('--prefix', default="", help="Only sync images under this folder")
+    parser.add_argument('--force', action='store_true', help="Regenerate existing thumbnails")
+    args = parser.parse_args()
+    
+    print(f"Image backend: {describe_image_backend()}")
+    s3_client = get_s3_client()
+    
+    existing = set()
+    if not args.force:
+        existing = {key for key, _ in list_keys(s3_client, args.bucket, THUMBNAIL_PREFIX + args.prefix)}
+    
+    pending = []
+    for key, size in list_keys(s3_client, args.bucket, args.prefix):
+        if (key.rpartition('.')[2].lower() not in IMAGE_EXTENSIONS
+                or size == 0
+                or key.startswith(THUMBNAIL_PREFIX)):
+            continue
+        widths = [
+            width for width in (None,) + SRCSET_WIDTHS
+            if thumbnail_key(key, width) not in existing
+        ]
+        if widths:
+            pending.append((key, widths))
+    print(f"{len(pending)} images need thumbnails")
+    
+    failed = 0
+    with ThreadPoolExecutor(max_workers=SYNC_WORKERS) as executor:
+        futures = {
+            executor.submit(write_thumbnails, s3_client, args.bucket, key, widths): key
+            for key, widths in pending
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            key = futures[future]
+            try:
+                if not future.result():
+                    failed += 1
+                    print(f"Skipped empty image {key}")
+            except Exception as e:
+                # One bad original (truncated, oversized, unreadable) must not stop the backfill
+                failed += 1
+                print(f"Error processing {key}: {e}")
+            if done % 100 == 0:
+                print(f"{done}/{len(pending)} done")
+    
+    print(f"Finished: {len(pending) - failed} uploaded, {failed} failed")
+
+if __name__ == "__main__":
+    main()
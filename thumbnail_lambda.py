@@ -0,0 +1,86 @@
+"""AWS Lambda handler that writes thumbnails as soon as a photo is uploaded
+
+Deploy with thumbnails.py alongside and set the handler to
+thumbnail_lambda.handler. Trigger it with the bucket's s3:ObjectCreated:*
+notification; the handler ignores its own writes under thumbs/. Folders
+with a .manifest.json also get the new image added to it.
+"""
+import json
+from datetime import datetime
+from urllib.parse import unquote_plus
+import boto3
+from botocore.exceptions import ClientError
+from thumbnails import IMAGE_EXTENSIONS, MANIFEST_NAME, THUMBNAIL_PREFIX, write_thumbnails
+
+MANIFEST_RETRIES = 5  # Attempts to merge into a manifest that other uploads keep changing
+
+# The execution role supplies credentials; created once per container
+s3_client = boto3.client('s3')
+
+def update_manifest(bucket, key, size, etag, event_time):
+    """Add or replace an uploaded image's entry in its folder's manifest, if it has one"""
+    manifest_key = key[:key.rfind('/') + 1] + MANIFEST_NAME
+    entry = {
+        'key': key,
+        'size': size,
+        # Event times end in 'Z'; listings and the app use aware UTC datetimes
+        'last_modified': datetime.fromisoformat(event_time.replace('Z', '+00:00')).isoformat(),
+        # Listings quote ETags, event records do not
+        'etag': '"' + etag.strip('"') + '"'
+    }
+    
+    for _ in range(MANIFEST_RETRIES):
+        try:
+            response = s3_client.get_object(Bucket=bucket, Key=manifest_key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return False  # Folders without a manifest are listed instead
+            raise
+        
+        entries = [item for item in json.loads(response['Body'].read()) if item['key'] != key]
+        entries.append(entry)
+        try:
+            # Only replace the manifest that was read, so concurrent uploads don't drop entries
+            s3_client.put_object(
+                Bucket=bucket,
+                Key=manifest_key,
+                Body=json.dumps(entries),
+                ContentType='application/json',
+                IfMatch=response['ETag']
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise
+    
+    print(f"Gave up updating {manifest_key} for {key}")
+    return False
+
+def handler(event, context):
+    """Generate the thumbnails of every image in an S3 ObjectCreated event"""
+    written = 0
+    for record in event.get('Records', []):
+        bucket = record['s3']['bucket']['name']
+        # Event keys arrive URL-encoded, with spaces as '+'
+        key = unquote_plus(record['s3']['object']['key'])
+        
+        # Skip our own thumbnails, which would otherwise trigger this again
+        if key.startswith(THUMBNAIL_PREFIX):
+            continue
+        if key.rpartition('.')[2].lower() not in IMAGE_EXTENSIONS:
+            continue
+        if record['s3']['object'].get('size', 1) == 0:
+            continue
+        
+        if write_thumbnails(s3_client, bucket, key):
+            written += 1
+            print(f"Wrote thumbnails for {key}")
+        
+        # Otherwise the app, which trusts the manifest, would never show this image
+        if update_manifest(
+            bucket, key, record['s3']['object']['size'],
+            record['s3']['object']['eTag'], record['eventTime']
+        ):
+            print(f"Added {key} to its folder's manifest")
+    
+    return {'thumbnails_written': written}
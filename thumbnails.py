@@ -0,0 +1,330 @@
+"""Thumbnail generation shared by the Streamlit app and the offline scripts"""
+from io import BytesIO
+import PIL
+from PIL import Image, features
+try:
+    import pyvips
+    # Every image is decoded once, so libvips' operation cache only holds
+    # memory and serialises the worker threads on its lock
+    pyvips.cache_set_max(0)
+except (ImportError, OSError):
+    pyvips = None  # Optional: thumbnails fall back to Pillow without libvips
+try:
+    import numpy
+    import simplejpeg
+except ImportError:
+    simplejpeg = None  # Optional: JPEG encoding falls back to Pillow
+
+# Thumbnail Configuration
+MAX_IMAGE_SIZE = (250, 250)  # Thumbnail size for display
+SRCSET_WIDTHS = (160, 320, 640)  # Responsive thumbnail widths pre-generated in S3
+THUMBNAIL_QUALITY = 70  # JPEG quality for thumbnails
+IMAGE_EXTENSIONS = frozenset(('jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'))
+READ_CHUNK_SIZE = 64 * 1024  # Chunk size for reading S3 object bodies
+THUMBNAIL_PREFIX = "thumbs/"  # Pre-generated thumbnails, mirroring the original keys
+THUMBNAIL_RANGE_BYTES = 512 * 1024  # Head of a large progressive JPEG read for its thumbnail
+JPEG_EOI = b'\xff\xd9'  # JPEG end-of-image marker
+THUMBNAIL_CACHE_CONTROL = "public, max-age=31536000, immutable"  # Thumbnails are replaced, never edited
+MANIFEST_NAME = ".manifest.json"  # Optional per-folder image list, read instead of listing the folder
+
+def thumbnail_key(key, width=None):
+    """Get the S3 key of the pre-generated thumbnail for an image"""
+    if width:
+        return f"{THUMBNAIL_PREFIX}{key}.{width}w.jpg"
+    return f"{THUMBNAIL_PREFIX}{key}.jpg"
+
+def srcset_size(width):
+    """Get the bounding box of a responsive thumbnail width"""
+    # Twice as tall as wide, so portrait photos still come out at the full width
+    return (width, 2 * width)
+
+def read_object_body(response, buffer=None):
+    """Read an S3 object body into a pre-sized buffer, appending to buffer if given"""
+    return read_stream(response['Body'], response.get('ContentLength'), buffer)
+
+def read_stream(body, size, buffer=None):
+    """Read up to size bytes of a stream into a pre-sized buffer, appending to buffer if given"""
+    if buffer is None:
+        buffer = BytesIO()
+    start = buffer.seek(0, 2)
+    
+    if size is None:
+        buffer.write(body.read())
+    elif size > 0:
+        # Grow the buffer once, then fill it in place chunk by chunk
+        buffer.seek(start + size - 1)
+        buffer.write(b'\0')
+        view = buffer.getbuffer()
+        offset = 0
+        try:
+            while offset < size:
+                chunk = body.read(min(READ_CHUNK_SIZE, size - offset))
+                if not chunk:
+                    break
+                view[start + offset:start + offset + len(chunk)] = chunk
+                offset += len(chunk)
+        finally:
+            view.release()
+        buffer.truncate(start + offset)
+    
+    # truncate() leaves the position alone, so check the length, not tell()
+    if buffer.seek(0, 2) == 0:
+        return None
+    buffer.seek(0)
+    return buffer
+
+def is_progressive_jpeg(image_buffer):
+    """Check whether a buffered image is a progressive JPEG"""
+    try:
+        image = Image.open(image_buffer)
+        return image.format == 'JPEG' and bool(image.info.get('progressive'))
+    except Exception:
+        return False
+    finally:
+        image_buffer.seek(0)
+
+def is_head_checked(key, size):
+    """Check whether an image's download may stop after its head"""
+    # Small files and non-JPEGs are always read whole
+    return size > THUMBNAIL_RANGE_BYTES and key.rpartition('.')[2].lower() in ('jpg', 'jpeg')
+
+class ReplayStream:
+    """A stream whose already-read head is replayed before the rest of it"""
+    
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.head.read() + self.stream.read()
+        return self.head.read(size) or self.stream.read(size)
+    
+    def close(self):
+        self.stream.close()
+
+def open_thumbnail_source(s3_client, bucket, key):
+    """Open as much of an image as its thumbnail needs with a single GET, as a GetObject response"""
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    body = response['Body']
+    # Sized by the GET itself; a cached listing may predate a replaced object
+    if not is_head_checked(key, response['ContentLength']):
+        return response
+    
+    head = read_stream(body, THUMBNAIL_RANGE_BYTES) or BytesIO()
+    
+    # Progressive JPEGs start with coarse scans of the whole frame, so the
+    # head of the file is enough; end it with an EOI marker for the decoder
+    if is_progressive_jpeg(head):
+        body.close()
+        head.seek(0, 2)
+        head.write(JPEG_EOI)
+        head.seek(0)
+        # Partial marks a body that is cut short on purpose
+        return {**response, 'Body': head, 'ContentLength': head.getbuffer().nbytes, 'Partial': True}
+    
+    # Baseline JPEGs need every scan line, so keep reading the same download
+    return {**response, 'Body': ReplayStream(head, body)}
+
+def read_thumbnail_source(response):
+    """Read an opened thumbnail source into a buffer"""
+    if response.get('Partial'):
+        # A progressive head, already buffered
+        return response['Body']
+    return read_object_body(response)
+
+def vips_source(stream, read_errors=None):
+    """Wrap a file-like object, such as an S3 body, as a streaming libvips source"""
+    source = pyvips.SourceCustom()
+    if read_errors is None:
+        source.on_read(stream.read)
+        return source
+    
+    # cffi only logs exceptions raised in callbacks, and libvips would take the
+    # failed read for the end of the file, so keep them for the caller to raise
+    def read(length):
+        if read_errors:
+            return b''
+        try:
+            return stream.read(length)
+        except Exception as e:
+            read_errors.append(e)
+            return b''
+    
+    source.on_read(read)
+    return source
+
+def save_vips_thumbnail(image, optimize=True):
+    """Encode a libvips thumbnail as JPEG bytes"""
+    # JPEG has no alpha channel; flatten transparent images onto white
+    if image.hasalpha():
+        image = image.flatten(background=[255, 255, 255])
+    
+    # Progressive output always takes a second Huffman pass, so both go together
+    return image.jpegsave_buffer(
+        Q=THUMBNAIL_QUALITY,
+        subsample_mode='on',  # 4:2:0 chroma
+        optimize_coding=optimize,
+        interlace=optimize,
+        strip=True
+    )
+
+def create_thumbnail_with_vips(image_buffer, size=MAX_IMAGE_SIZE, optimize=True):
+    """Create JPEG thumbnail bytes with libvips, which shrinks while decoding"""
+    # Like Pillow's thumbnail(), never enlarge images smaller than the box
+    image = pyvips.Image.thumbnail_buffer(
+        image_buffer.getbuffer(), size[0], height=size[1], size='down'
+    )
+    return save_vips_thumbnail(image, optimize)
+
+def create_thumbnail_from_stream(stream, size=MAX_IMAGE_SIZE, optimize=True, partial=False):
+    """Create JPEG thumbnail bytes with libvips, decoding while a download streams in"""
+    # libvips reads the source lazily, so it stays referenced here until the save
+    read_errors = []
+    source = vips_source(stream, read_errors)
+    
+    # A download cut short must fail rather than come out half grey; only a
+    # partial source, like a progressive JPEG's head, is truncated on purpose.
+    # thumbnail's own fail_on does not reach the loader, so pass it as a load option
+    image = pyvips.Image.thumbnail_source(
+        source, size[0], height=size[1], size='down',
+        option_string='' if partial else 'fail_on=truncated'
+    )
+    try:
+        thumbnail = save_vips_thumbnail(image, optimize)
+    except pyvips.Error:
+        # The truncation libvips reports was caused by the failed read
+        if read_errors:
+            raise read_errors[0]
+        raise
+    
+    if read_errors:
+        raise read_errors[0]
+    return thumbnail
+
+def flatten_to_rgb(image):
+    """Convert an image to RGB, compositing any transparency onto white"""
+    if image.mode in ('RGB', 'L'):
+        return image
+    
+    # Palette images only carry alpha when they declare a transparent colour
+    if image.mode == 'P' and 'transparency' in image.info:
+        image = image.convert('RGBA')
+    
+    if image.mode in ('RGBA', 'LA', 'PA'):
+        alpha = image.getchannel('A')
+        # Fully opaque images (common for PNG exports) skip the composite
+        if alpha.getextrema()[0] < 255:
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=alpha)
+            return background
+    
+    return image.convert('RGB')
+
+def prepare_for_resize(image):
+    """Convert modes Pillow cannot filter, keeping any transparency for a later flatten"""
+    if image.mode in ('RGB', 'L', 'RGBA', 'LA'):
+        return image
+    
+    # Palette images resize with nearest-neighbour, so expand them first
+    has_alpha = image.mode == 'PA' or 'transparency' in image.info
+    return image.convert('RGBA' if has_alpha else 'RGB')
+
+def encode_jpeg(image, quality):
+    """Encode an RGB or greyscale Pillow image as JPEG bytes with 4:2:0 chroma"""
+    if simplejpeg is not None:
+        # A single call into libjpeg-turbo, without Pillow's encoder setup
+        if image.mode == 'L':
+            return simplejpeg.encode_jpeg(
+                numpy.asarray(image)[..., None], quality=quality,
+                colorspace='GRAY', colorsubsampling='Gray'
+            )
+        return simplejpeg.encode_jpeg(
+            numpy.asarray(image), quality=quality,
+            colorspace='RGB', colorsubsampling='420'
+        )
+    
+    output_buffer = BytesIO()
+    image.save(output_buffer, format='JPEG', quality=quality, subsampling=2)
+    return output_buffer.getvalue()
+
+def create_thumbnail_with_pillow(image_buffer, size=MAX_IMAGE_SIZE, optimize=True):
+    """Create JPEG thumbnail bytes with Pillow"""
+    image = Image.open(image_buffer)
+    
+    # Let libjpeg decode straight to a reduced scale (1/2 to 1/8), keeping
+    # at least twice the thumbnail size so the final resample has clean input
+    oversampled = (size[0] * 2, size[1] * 2)
+    if image.format == 'JPEG':
+        image.draft('RGB', oversampled)
+    
+    # A no-op for JPEGs, which draft() already decoded as RGB
+    image = prepare_for_resize(image)
+    
+    # Box-filter by the whole factor that still covers twice the target size,
+    # so the HAMMING pass keeps the oversampled headroom
+    factor = min(image.width // oversampled[0], image.height // oversampled[1])
+    if factor > 1:
+        image = image.reduce(factor)
+    
+    # Resample the small remainder to the exact thumbnail size
+    image.thumbnail(size, Image.Resampling.HAMMING, reducing_gap=None)
+    
+    # Composite any transparency onto white now that the image is small
+    image = flatten_to_rgb(image)
+    
+    # A single fast baseline pass when the thumbnail is needed right away
+    if not optimize:
+        return encode_jpeg(image, THUMBNAIL_QUALITY)
+    
+    # Return the JPEG bytes; st.image accepts them directly
+    output_buffer = BytesIO()
+    image.save(
+        output_buffer,
+        format='JPEG',
+        quality=THUMBNAIL_QUALITY,
+        subsampling=2,  # 4:2:0 chroma
+        optimize=True,
+        progressive=True
+    )
+    
+    return output_buffer.getvalue()
+
+def write_thumbnails(s3_client, bucket, key, widths=(None,) + SRCSET_WIDTHS):
+    """Generate an image's thumbnails and upload them under THUMBNAIL_PREFIX"""
+    # Fetch the whole original; the larger srcset widths need every scan
+    image_buffer = read_object_body(s3_client.get_object(Bucket=bucket, Key=key))
+    if image_buffer is None:
+        return False
+    
+    # A width of None is the standard gallery thumbnail
+    for width in widths:
+        image_buffer.seek(0)
+        size = srcset_size(width) if width else MAX_IMAGE_SIZE
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=thumbnail_key(key, width),
+            Body=create_thumbnail(image_buffer, key, size),
+            ContentType='image/jpeg',
+            CacheControl=THUMBNAIL_CACHE_CONTROL
+        )
+    return True
+
+def describe_image_backend():
+    """Describe the imaging libraries thumbnails are made with"""
+    # Pillow-SIMD releases carry a ".postN" version suffix
+    pillow_name = "Pillow-SIMD" if '.post' in PIL.__version__ else "Pillow"
+    jpeg_codec = "libjpeg-turbo" if features.check_feature('libjpeg_turbo') else "libjpeg"
+    vips = f"libvips {pyvips.version(0)}.{pyvips.version(1)}" if pyvips else "no libvips"
+    return f"{pillow_name} {PIL.__version__} with {jpeg_codec}, {vips}"
+
+def create_thumbnail(image_buffer, key, size=MAX_IMAGE_SIZE, optimize=True):
+    """Create JPEG thumbnail bytes, preferring libvips over Pillow"""
+    # optimize trades encode time for a smaller, progressive file
+    if pyvips is not None:
+        try:
+            return create_thumbnail_with_vips(image_buffer, size, optimize)
+        except pyvips.Error as vips_error:
+            print(f"libvips cannot process {key.split('/')[-1]}, using Pillow: {vips_error}")
+    
+    return create_thumbnail_with_pillow(image_buffer, size, optimize)